@@ -1,16 +1,23 @@
 import numpy as np
-from scipy.spatial import distance
+from scipy.spatial import cKDTree
+from numba import njit, prange
 import geopandas as gpd
 import pandas as pd
-from shapely.geometry import Point
+import shapely
 import os
+import hashlib
+from itertools import chain
 from pathlib import Path
 
+#Neighborhood rule (m) - distance where neighborhoods start growing,
+#equidistant range (base, growth) and close range (base, growth)
+NEIGHBORHOOD_RULE = (9.144, 0.3658, 0.1524, 1.524, 0.3048)
+
 #Input with validation
 def define_input():
     while True:
         print("Enter all parameters in format: csv file path, grid file path, output file path")
-        print("Example: \"C:/Users/Desktop/output/shooting_data.csv\", \"C:/Users/Desktop/grid_file.shp\", \"C:/Users/Desktop/output/EB.shp\"")
+        print("Example: \"C:/Users/Desktop/output/shooting_data.csv\", \"C:/Users/Desktop/grid_file.shp\", \"C:/Users/Desktop/output/EB.gpkg\"")
         
         user_input = input().strip()
         
@@ -34,16 +41,16 @@ def define_input():
                 print("Error: All file paths must be filled.")
                 continue
                 
-            if not csv_file.lower().endswith('.csv'):
-                print("Error: CSV file must have a .csv extension.")
+            if not csv_file.lower().endswith(('.csv', '.parquet')):
+                print("Error: Shooting data file must have a .csv or .parquet extension.")
                 continue
                 
-            if not grid_file.lower().endswith('.shp'):
-                print("Error: Grid file must have a .shp extension.")
+            if not grid_file.lower().endswith(('.shp', '.gpkg')):
+                print("Error: Grid file must have a .shp or .gpkg extension.")
                 continue
                 
-            if not output_file.lower().endswith('.shp'):
-                print("Error: Output file must have a .shp extension.")
+            if not output_file.lower().endswith('.gpkg'):
+                print("Error: Output file must have a .gpkg extension.")
                 continue
             
             #Check if input files exist
@@ -52,7 +59,7 @@ def define_input():
                 continue
                 
             if not os.path.isfile(grid_file):
-                print(f"Error: Grid shapefile does not exist: {grid_file}")
+                print(f"Error: Grid file does not exist: {grid_file}")
                 continue
             
             #Validate output directory
@@ -74,6 +81,41 @@ def define_input():
             print(f"Error parsing input: {str(e)}")
             print("Please check your input format and try again.")
 
+#Assign points to cells of a regular axis-aligned grid (None if grid is not regular)
+def assign_to_regular_grid(grid_gdf, x, y):
+    bounds = grid_gdf.bounds
+    x_edges = np.unique(np.r_[bounds['minx'], bounds['maxx']])
+    y_edges = np.unique(np.r_[bounds['miny'], bounds['maxy']])
+    nx, ny = len(x_edges) - 1, len(y_edges) - 1
+    if nx * ny != len(grid_gdf):
+        return None
+
+    #Every cell must be a rectangle spanning exactly one column and one row
+    col = np.searchsorted(x_edges, bounds['minx'].to_numpy())
+    row = np.searchsorted(y_edges, bounds['miny'].to_numpy())
+    box_area = (bounds['maxx'] - bounds['minx']) * (bounds['maxy'] - bounds['miny'])
+    if (
+        not np.array_equal(x_edges[col + 1], bounds['maxx'].to_numpy()) or
+        not np.array_equal(y_edges[row + 1], bounds['maxy'].to_numpy()) or
+        not np.allclose(grid_gdf.geometry.area.to_numpy(), box_area.to_numpy())
+    ):
+        return None
+
+    cell_lookup = np.full((ny, nx), -1, dtype=np.intp)
+    cell_lookup[row, col] = np.arange(len(grid_gdf))
+    if (cell_lookup < 0).any():
+        return None
+
+    #Find column and row of each point (points on cell edges are not within any cell)
+    ix = np.searchsorted(x_edges, x, side='right') - 1
+    iy = np.searchsorted(y_edges, y, side='right') - 1
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    inside[inside] &= (x[inside] != x_edges[ix[inside]]) & (y[inside] != y_edges[iy[inside]])
+
+    shot_idx = np.flatnonzero(inside)
+    cell_idx = cell_lookup[iy[shot_idx], ix[shot_idx]]
+    return shot_idx, cell_idx
+
 #Prepare data for Empirical Bayes analysis
 def prepare_data_for_eb(csv_path, grid_shp_path):
     print("Checking existence of input files...")
@@ -84,7 +126,10 @@ def prepare_data_for_eb(csv_path, grid_shp_path):
 
     print("Loading CSV file...")
     try:
-        shots_df = pd.read_csv(csv_path)
+        if str(csv_path).lower().endswith('.parquet'):
+            shots_df = pd.read_parquet(csv_path)
+        else:
+            shots_df = pd.read_csv(csv_path)
     except Exception as e:
         raise ValueError(f"Error while loading csv file: {e}")
 
@@ -106,16 +151,15 @@ def prepare_data_for_eb(csv_path, grid_shp_path):
     print("Calculating points scored...")
     shots_df['points'] = shots_df['action'] * shots_df['made'] 
 
-    #Make point geometry 
+    #Get shot coordinates
     try:
-        geometry = [Point(xy) for xy in zip(shots_df['x'], shots_df['y'])]
-        shots_gdf = gpd.GeoDataFrame(shots_df, geometry=geometry, crs='EPSG:3857')
+        shot_xy = shots_df[['x', 'y']].to_numpy(dtype=float)
     except Exception as e:
-        raise ValueError(f"Error while making point geometries: {e}")
+        raise ValueError(f"Error while reading shot coordinates: {e}")
 
     print("Loading grid shapefile...")
     try:
-        grid_gdf = gpd.read_file(grid_shp_path)
+        grid_gdf = gpd.read_file(grid_shp_path, engine='pyogrio')
     except Exception as e:
         raise ValueError(f"Error while loading shapefile: {e}")
 
@@ -125,43 +169,50 @@ def prepare_data_for_eb(csv_path, grid_shp_path):
     if grid_gdf.crs != 'EPSG:3857':
         grid_gdf = grid_gdf.to_crs('EPSG:3857')
 
-    shots_with_grid = gpd.sjoin(shots_gdf, grid_gdf, how='left', predicate='within')
+    #Assign shots to grid cells (bin lookup for regular grids, spatial index otherwise)
+    assigned = assign_to_regular_grid(grid_gdf, shot_xy[:, 0], shot_xy[:, 1])
+    if assigned is not None:
+        shot_idx, cell_idx = assigned
+    else:
+        print("Grid is not a regular rectangular grid, using spatial index...")
+        grid_tree = shapely.STRtree(grid_gdf.geometry.values)
+        shot_idx, cell_idx = grid_tree.query(shapely.points(shot_xy), predicate='within')
 
-    unassigned_shots = shots_with_grid['index_right'].isna().sum()
+    unassigned_shots = len(shots_df) - len(np.unique(shot_idx))
     if unassigned_shots > 0:
         print(f"Note: {unassigned_shots} shots were not assigned to any grid cell.")
 
-    shots_assigned = shots_with_grid.dropna(subset=['index_right'])
-
-    if shots_assigned.empty:
+    if len(cell_idx) == 0:
         raise ValueError("No shots were assigned to any grid cell. Check coordinate system compatibility.")
 
     #Calculate statistics for grid cells
     print("Calculating statistics for grid cells...")
-    grid_stats = shots_assigned.groupby('index_right').agg({
-        'points': 'sum',
-        'action': 'count'
-    }).reset_index()
+    #Sort shot-cell pairs by cell so each cell is a contiguous run
+    order = np.argsort(cell_idx, kind='stable')
+    cell_sorted = cell_idx[order]
+    points_sorted = shots_df['points'].to_numpy(dtype=float)[shot_idx[order]]
+
+    run_starts = np.flatnonzero(np.r_[True, cell_sorted[1:] != cell_sorted[:-1]])
+    run_cells = cell_sorted[run_starts]
+
+    points_sum = np.zeros(len(grid_gdf))
+    points_sum[run_cells] = np.add.reduceat(points_sorted, run_starts)
+    attempts = np.zeros(len(grid_gdf), dtype=int)
+    attempts[run_cells] = np.diff(np.r_[run_starts, len(cell_sorted)])
 
-    grid_stats = grid_stats.rename(columns={
-        'action': 'attempts',
-        'points': 'points'
-    })
+    result_gdf = grid_gdf.copy()
+    result_gdf['points'] = points_sum.astype(int)
+    result_gdf['attempts'] = attempts
 
     #Calculate Points Per Attempt (PPA)
     print("Calculating Points Per Attempt (PPA)...")
-    grid_stats['PPA'] = np.where(
-        grid_stats['attempts'] > 0,
-        grid_stats['points'] / grid_stats['attempts'],
-        0
+    result_gdf['PPA'] = np.divide(
+        result_gdf['points'].to_numpy(dtype=float),
+        result_gdf['attempts'].to_numpy(dtype=float),
+        out=np.zeros(len(result_gdf)),
+        where=result_gdf['attempts'].to_numpy() > 0
     )
 
-    result_gdf = grid_gdf.merge(grid_stats, left_index=True, right_on='index_right', how='left')
-
-    result_gdf['attempts'] = result_gdf['attempts'].fillna(0).astype(int)
-    result_gdf['points'] = result_gdf['points'].fillna(0).astype(int)
-    result_gdf['PPA'] = result_gdf['PPA'].fillna(0)
-
     if 'left' not in result_gdf.columns:
         print("Calculating grid bounds...")
         bounds = result_gdf.bounds
@@ -173,139 +224,166 @@ def prepare_data_for_eb(csv_path, grid_shp_path):
     print("Data preparation for Empirical Bayes completed.")
     return result_gdf
 
+#Calculate Empirical Bayes parameters for each cell from its neighborhood (CSR format)
+@njit(parallel=True, cache=True)
+def eb_kernel(n, p, r, indptr, indices, phi_out, w_out, theta_out):
+    for i in prange(len(n)):
+        neighbor_count = 0
+        total_shots = 0.0
+        total_makes = 0.0
+        numerator = 0.0
+
+        #Calculate neighborhood statistics
+        for k in range(indptr[i], indptr[i + 1]):
+            j = indices[k]
+            if n[j] <= 0:
+                continue
+            gamma_j = p[j] / n[j]
+            neighbor_count += 1
+            total_shots += n[j]
+            total_makes += p[j]
+            numerator += n[j] * (r[j] - gamma_j) ** 2
+
+        #No neighbors - use raw PPA
+        if neighbor_count == 0:
+            phi_out[i] = 0.0
+            w_out[i] = 0.0
+            theta_out[i] = r[i]
+            continue
+
+        gamma_i = total_makes / total_shots if total_shots > 0 else 0.0
+        n_bar_j = total_shots / neighbor_count
+
+        #Calculate variance parameter
+        if total_shots > 0 and n_bar_j > 0:
+            phi_i = max(0.0, (numerator / total_shots) - (gamma_i / n_bar_j))
+        else:
+            phi_i = 0.0
+
+        #Calculate shrinkage weight
+        if n[i] > 0 and (phi_i + gamma_i / n[i]) != 0:
+            w_hat_i = max(0.0, min(1.0, phi_i / (phi_i + gamma_i / n[i])))
+        else:
+            w_hat_i = 0.0
+
+        #Calculate smoothed PPA
+        phi_out[i] = phi_i
+        w_out[i] = w_hat_i
+        theta_out[i] = w_hat_i * r[i] + (1 - w_hat_i) * gamma_i
+
+#Build neighborhoods for grid cells in CSR format (indptr - row offsets, indices - neighbors)
+def build_neighborhoods(x, y, d):
+    #Define neighborhood parameters for each cell
+    #Close to basket: fixed ranges, far from basket: larger neighborhood
+    grow_from, equidistant_base, equidistant_growth, close_base, close_growth = NEIGHBORHOOD_RULE
+    extra_feet = np.maximum(d - grow_from, 0)
+    equidistant_range = equidistant_base + (equidistant_growth * extra_feet)
+    close_range = close_base + (close_growth * extra_feet)
+
+    cell_coords = np.column_stack([x, y])
+    tree = cKDTree(cell_coords)
+    candidates = tree.query_ball_point(cell_coords, r=close_range)
+
+    #Keep candidates within equidistant range
+    rows = np.repeat(np.arange(len(candidates)), [len(c) for c in candidates])
+    cols = np.fromiter(chain.from_iterable(candidates), dtype=np.intp, count=len(rows))
+    keep = np.abs(d[cols] - d[rows]) <= equidistant_range[rows]
+
+    indptr = np.zeros(len(x) + 1, dtype=np.intp)
+    np.cumsum(np.bincount(rows[keep], minlength=len(x)), out=indptr[1:])
+    indices = cols[keep]
+
+    return indptr, indices
+
+#Load neighborhoods cached next to the grid file or build and cache them
+def get_neighborhoods(grid_shp_path, basket_coords, x, y, d):
+    grid_path = Path(grid_shp_path)
+
+    #Cache key - grid file content (with shapefile sidecars), basket position and neighborhood rule
+    grid_hash = hashlib.sha1()
+    for suffix in ('.shp', '.dbf', '.prj') if grid_path.suffix.lower() == '.shp' else (grid_path.suffix,):
+        part_path = grid_path.with_suffix(suffix)
+        if part_path.exists():
+            grid_hash.update(part_path.read_bytes())
+    grid_hash.update(repr(tuple(basket_coords)).encode())
+    grid_hash.update(repr(NEIGHBORHOOD_RULE).encode())
+    cache_path = grid_path.with_name(f"{grid_path.stem}_nbhd_{grid_hash.hexdigest()[:16]}.npz")
+
+    if cache_path.exists():
+        with np.load(cache_path) as cache:
+            indptr, indices = cache['indptr'], cache['indices']
+        if len(indptr) == len(x) + 1:
+            print(f"Loaded cached neighborhoods: {cache_path}")
+            return indptr, indices
+        print(f"Cached neighborhoods do not match grid, rebuilding: {cache_path}")
+
+    print(f"Building neighborhoods for {len(x)} grids...")
+    indptr, indices = build_neighborhoods(x, y, d)
+
+    try:
+        np.savez(cache_path, indptr=indptr, indices=indices)
+        print(f"Cached neighborhoods: {cache_path}")
+    except OSError as e:
+        print(f"Note: Could not cache neighborhoods: {e}")
+
+    return indptr, indices
+
 #Perform main Empirical Bayes analysis
-def do_eb(csv_path, grid_shp_path, output_path='EB.shp', basket_coords=(0, 12.425)):
+def do_eb(csv_path, grid_shp_path, output_path='EB.gpkg', basket_coords=(0, 12.425)):
     print("Starting Empirical Bayes analysis...")
     grid_data = prepare_data_for_eb(csv_path, grid_shp_path)
 
     grid_data['x'] = (grid_data['left'] + grid_data['right']) / 2
     grid_data['y'] = (grid_data['bottom'] + grid_data['top']) / 2
 
-    grid_data['dist_to_basket'] = np.sqrt(
-        (grid_data['x'] - basket_coords[0]) ** 2 +
-        (grid_data['y'] - basket_coords[1]) ** 2
+    grid_data['dist_to_basket'] = np.hypot(
+        grid_data['x'].to_numpy() - basket_coords[0],
+        grid_data['y'].to_numpy() - basket_coords[1]
     )
 
-    numeric_columns = ['attempts', 'points', 'PPA']
-    for col in numeric_columns:
-        grid_data[col] = pd.to_numeric(grid_data[col], errors='coerce').fillna(0)
-
     invalid_grids = grid_data[grid_data['points'] > grid_data['attempts'] * 3]
     if not invalid_grids.empty:
         print("Warning: Some grids have invalid points (points > attempts * 3).")
 
-    active_grids = grid_data[grid_data['attempts'] > 0].copy()
+    #Extract cell arrays for vectorized computation
+    x = grid_data['x'].to_numpy(dtype=float)
+    y = grid_data['y'].to_numpy(dtype=float)
+    d = grid_data['dist_to_basket'].to_numpy(dtype=float)
+    n = grid_data['attempts'].to_numpy(dtype=float)
+    p = grid_data['points'].to_numpy(dtype=float)
+    r = grid_data['PPA'].to_numpy(dtype=float)
 
-    if active_grids.empty:
+    active = n > 0
+    if not active.any():
         raise ValueError("No grids with attempts for analysis.")
 
-    #Define function to get neighborhood parameters for each cell
-    def get_neighborhood_params(row, gdf):
-        d = row['dist_to_basket']
-        if d < 9.144:  #Close to basket
-            equidistant_range = 0.3658
-            close_range = 1.524
-        else:  #Far from basket - larger neighborhood
-            extra_feet = d - 9.144
-            equidistant_range = 0.3658 + (0.1524 * extra_feet)
-            close_range = 1.524 + (0.3048 * extra_feet)
-
-        neighborhood = gdf[
-            (abs(gdf['dist_to_basket'] - d) <= equidistant_range) &
-            (distance.cdist([[row['x'], row['y']]], gdf[['x', 'y']].values)[0] <= close_range) &
-            (gdf['attempts'] > 0)
-        ]
-
-        return neighborhood
-
-    #Set up Empirical Bayes parameters
-    print("Initializing Empirical Bayes parameters...")
-    phi_values = []     
-    w_hat_values = []  
-    theta_values = []    
-
-    #Calculate Empirical Bayes parameters for each active cell
-    print("Calculating Empirical Bayes parameters for active grids...")
-    for idx, row in active_grids.iterrows():
-        print(f"Processing grid {idx}...")
-        neighborhood = get_neighborhood_params(row, active_grids)
-
-        if neighborhood.empty:
-            print(f"No neighbors found for grid {idx}, using raw PPA.")
-            phi_values.append(0)
-            w_hat_values.append(0)
-            theta_values.append(row['PPA'])
-            continue
-
-        #Calculate neighborhood statistics
-        print(f"Calculating statistics for neighborhood of grid {idx}...")
-        total_shots = neighborhood['attempts'].sum()
-        total_makes = neighborhood['points'].sum()
-
-        gamma_i = total_makes / total_shots if total_shots > 0 else 0
-
-        #Calculate variance
-        print(f"Calculating variance for grid {idx}...")
-        n_bar_j = neighborhood['attempts'].mean()
-        n_j = neighborhood['attempts']
-        r_j = neighborhood['PPA']
-
-        gamma_j = neighborhood['points'] / neighborhood['attempts']
-        gamma_j = gamma_j.replace([np.inf, -np.inf], 0).fillna(0)
+    indptr, indices = get_neighborhoods(grid_shp_path, basket_coords, x, y, d)
 
-        #Calculate variance parameter
-        numerator = np.sum(n_j * (r_j - gamma_j) ** 2)
-        denominator = np.sum(n_j)
-
-        if denominator > 0 and n_bar_j > 0:
-            phi_i = (numerator / denominator) - (gamma_i / n_bar_j)
-            phi_i = max(0, phi_i)
-        else:
-            phi_i = 0
-
-        phi_values.append(phi_i)
-
-        #Calculate shrinkage weight
-        print(f"Calculating shrinkage weight for grid {idx}...")
-        n_i = row['attempts']
-        if n_i > 0 and (phi_i + gamma_i / n_i) != 0:
-            w_hat_i = phi_i / (phi_i + gamma_i / n_i)
-            w_hat_i = max(0, min(1, w_hat_i))
-        else:
-            w_hat_i = 0
-
-        w_hat_values.append(w_hat_i)
-
-        #Calculate smoothed PPA
-        print(f"Calculating smoothed PPA for grid {idx}...")
-        r_i = row['PPA']
-        theta_i = w_hat_i * r_i + (1 - w_hat_i) * gamma_i
-        theta_values.append(theta_i)
-
-        if theta_i > 3 or theta_i < 0:
-            print(f"Note - Grid {idx}: theta_i={theta_i:.3f} (r_i={r_i:.3f}, gamma_i={gamma_i:.3f})")
-
-    #Add Empirical Bayes parameters to active grids
-    print("Adding Empirical Bayes parameters to active grids...")
-    active_grids['CellVar'] = phi_values
-    active_grids['ShrinkWt'] = w_hat_values
-    active_grids['EB_PPA'] = theta_values
-
-    #Merge results with full grid data
-    grid_data = grid_data.merge(
-        active_grids[['CellVar', 'ShrinkWt', 'EB_PPA']],
-        left_index=True,
-        right_index=True,
-        how='left'
-    )
-
-    #Set Empirical Bayes parameters to 0 for grids without attempts
-    grid_data['CellVar'] = grid_data['CellVar'].where(grid_data['attempts'] > 0, 0)
-    grid_data['ShrinkWt'] = grid_data['ShrinkWt'].where(grid_data['attempts'] > 0, 0)
-    grid_data['EB_PPA'] = grid_data['EB_PPA'].where(grid_data['attempts'] > 0, 0)
-
-    #Save results to shapefile
-    print("Saving results to shapefile...")
+    #Calculate Empirical Bayes parameters (kernel skips neighbors without attempts)
+    print("Calculating Empirical Bayes parameters for active grids...")
+    phi_values = np.empty(len(grid_data))
+    w_hat_values = np.empty(len(grid_data))
+    theta_values = np.empty(len(grid_data))
+    eb_kernel(n, p, r, indptr, indices, phi_values, w_hat_values, theta_values)
+
+    neighbor_rows = np.repeat(np.arange(len(grid_data)), np.diff(indptr))
+    active_neighbors = np.bincount(neighbor_rows, weights=n[indices] > 0, minlength=len(grid_data))
+    no_neighbors = active & (active_neighbors == 0)
+    if no_neighbors.any():
+        print(f"No neighbors found for {no_neighbors.sum()} grid(s), using raw PPA.")
+
+    out_of_range = active & ((theta_values > 3) | (theta_values < 0))
+    if out_of_range.any():
+        print(f"Note: {out_of_range.sum()} grid(s) have smoothed PPA outside [0, 3]: {grid_data.index[out_of_range].tolist()}")
+
+    #Add Empirical Bayes parameters to grid data (0 for grids without attempts)
+    print("Adding Empirical Bayes parameters to grid data...")
+    grid_data['CellVar'] = np.where(active, phi_values, 0)
+    grid_data['ShrinkWt'] = np.where(active, w_hat_values, 0)
+    grid_data['EB_PPA'] = np.where(active, theta_values, 0)
+
+    #Save results to GeoPackage
+    print("Saving results to GeoPackage...")
     try:
         output_dir = os.path.dirname(output_path)
         if output_dir and not os.path.exists(output_dir):
@@ -314,7 +392,7 @@ def do_eb(csv_path, grid_shp_path, output_path='EB.shp', basket_coords=(0, 12.42
             
         grid_data = grid_data.rename(columns={'dist_to_basket': 'distance'})    
 
-        grid_data.to_file(output_path)
+        grid_data.to_file(output_path, driver='GPKG', engine='pyogrio')
 
     except Exception as e:
         print(f"Error while saving: {e}")
@@ -68,11 +68,13 @@ for csv_file in csv_files:
         print(f"Failed to load {csv_file}: {e}")
         continue
 
-    #Clean numerical data
+    #Clean numerical data (convert decimal commas in text columns)
     for column in df.columns[1:]:
         if pd.api.types.is_numeric_dtype(df[column]):
-            df[column] = df[column].apply(lambda x: str(x).replace('.', ',') if pd.notnull(x) else x)
-            df[column] = pd.to_numeric(df[column].str.replace(',', '.'), errors='coerce')
+            continue
+        converted = pd.to_numeric(df[column].astype(str).str.replace(',', '.', regex=False), errors='coerce')
+        if converted.notna().sum() == df[column].notna().sum():
+            df[column] = converted
 
     #Calculate metrics
     print(f"Calculating metrics for {csv_file}...")
@@ -102,15 +104,10 @@ for csv_file in csv_files:
 
         #eFG%
         def calculate_efg_pct(df, fga_col, ppb_col, pts_sum_col):
-            temp_calc = 0.0
-            ppb_3_sum = 0.0
-            for _, row in df.iterrows():
-                if row[ppb_col] == 3:
-                    value = row[pts_sum_col] / 3
-                    temp_calc += value
-                    ppb_3_sum += value
-                elif row[ppb_col] == 2:
-                    temp_calc += row[pts_sum_col] / 2
+            ppb = df[ppb_col].to_numpy()
+            pts = df[pts_sum_col].to_numpy(dtype=float)
+            ppb_3_sum = (pts[ppb == 3] / 3).sum()
+            temp_calc = ppb_3_sum + (pts[ppb == 2] / 2).sum()
 
             fga_total = df[fga_col].sum()
             efg_pct = (((temp_calc + ppb_3_sum * 0.5) / fga_total)*100) if fga_total != 0 else 0
@@ -133,20 +130,22 @@ for csv_file in csv_files:
     prla = ssce * sum_fga
     FG_pct = (made_shots / df['FGA'].sum()) * 100 if ('PTS' in df.columns and 'FGA' in df.columns and df['FGA'].sum() > 0) else 0
 
-    #Create DataFrame with metrics
-    stats_df = pd.DataFrame({
-        'EPPA': [eppa],
-        'PPA': [ppa],
-        'SScE': [ssce],
-        'PRLA': [prla],
-        'FG_pct': [FG_pct],
-        '2FG_pct': [two_pt_pct],
-        '3FG_pct': [three_pt_pct],
-        'eFG_pct': [efg_pct],
-        'FGA_sum': [fga_sum],
-    })
-
-    df_with_stats = pd.concat([df, stats_df], axis=1)
+    #Add metrics as columns (keep one row for files without shots)
+    stats = {
+        'EPPA': eppa,
+        'PPA': ppa,
+        'SScE': ssce,
+        'PRLA': prla,
+        'FG_pct': FG_pct,
+        '2FG_pct': two_pt_pct,
+        '3FG_pct': three_pt_pct,
+        'eFG_pct': efg_pct,
+        'FGA_sum': fga_sum,
+    }
+
+    if df.empty:
+        df = df.reindex([0])
+    df_with_stats = df.assign(**stats)
 
     #Save results
     print(f"Saving results for {csv_file}...")
@@ -154,7 +153,9 @@ for csv_file in csv_files:
     output_path = os.path.join(output_folder, output_file)
 
     try:
-        df_with_stats.to_excel(output_path, index=False, float_format='%.15g')
+        #constant_memory is not used - pandas writes cells column by column
+        with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
+            df_with_stats.to_excel(writer, index=False, float_format='%.15g')
         print(f"Successfully saved {output_file} in {output_path}")
     except Exception as e:
         print(f"Failed to save {output_file}: {e}")
@@ -2,13 +2,16 @@ from pathlib import Path
 import geopandas as gpd
 import pandas as pd
 import numpy as np
+import shapely
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 
 #Input with validation
 def define_input():
     while True:
-        print("Enter all parameters in format: input players folder path, EB shapefile path, output folder path")
-        print("Example: \"C:/Users/Desktop/output/players\", \"C:/Users/Desktop/output/EB.shp\", \"C:/Users/Desktop/output/local_metrics\"")
+        print("Enter all parameters in format: input players folder path, EB layer path, output folder path")
+        print("Example: \"C:/Users/Desktop/output/players\", \"C:/Users/Desktop/output/EB.gpkg\", \"C:/Users/Desktop/output/local_metrics\"")
         
         user_input = input().strip()
         
@@ -32,12 +35,12 @@ def define_input():
                 print(f"Error: Input folder does not exist or is not a directory: {input_folder}")
                 continue
             
-            #Validate EB shapefile
+            #Validate EB layer
             if not grid_file.exists() or not grid_file.is_file():
-                print(f"Error: EB shapefile does not exist: {grid_file}")
+                print(f"Error: EB file does not exist: {grid_file}")
                 continue
-            if not grid_file.suffix.lower() == ".shp":
-                print("Error: EB file must have a .shp extension.")
+            if grid_file.suffix.lower() not in (".shp", ".gpkg"):
+                print("Error: EB file must have a .shp or .gpkg extension.")
                 continue
             
             #Validate or create output folder
@@ -55,30 +58,22 @@ def define_input():
             print(f"Error parsing input: {str(e)}")
             print("Please check your input format and try again.")
 
-input_folder, grid_layer_path, output_folder = define_input()
-print("Input file paths collected successfully.")
+#Load EB layer and build spatial index (cached once per process)
+@lru_cache(maxsize=None)
+def load_grid(grid_layer_path):
+    grid_gdf = gpd.read_file(grid_layer_path, engine="pyogrio", columns=['distance', 'EB_PPA'])[['geometry', 'distance', 'EB_PPA']]
+    grid_tree = shapely.STRtree(grid_gdf.geometry.values)
+    return grid_gdf, grid_tree
 
-#Create output directory if it doesn't exist
-output_folder.mkdir(parents=True, exist_ok=True)
-print(f"Output directory created or already exists: {output_folder}")
+#Process single player layer
+def process_one_file(input_file, grid_layer_path, output_folder):
+    grid_gdf, grid_tree = load_grid(grid_layer_path)
 
-#Load EB layer and select relevant columns
-print("Loading grid layer shapefile...")
-grid_gdf = gpd.read_file(grid_layer_path)[['geometry', 'distance', 'EB_PPA']]
-print(f"Number of polygons in grid_gdf: {len(grid_gdf)}")
-
-#Collect all shapefile paths from input folder
-input_files = [f for f in input_folder.glob("*.shp")]
-print(f"Found {len(input_files)} shapefile(s) in input folder.")
-
-#Process data
-print("Starting data processing for shapefiles...")
-for input_file in input_files:
     layer_name = input_file.stem
-    print(f"\nProcessing shapefile: {input_file.name}...")
+    print(f"\nProcessing layer: {input_file.name}...")
     
     #Load shooting data
-    points_gdf = gpd.read_file(input_file)
+    points_gdf = gpd.read_file(input_file, engine="pyogrio")
     print(f"Number of points in {input_file.name}: {len(points_gdf)}")
 
     #Match CRS's
@@ -96,18 +91,21 @@ for input_file in input_files:
         print(f"Columns 'action' or 'made' missing in {input_file.name}. Setting PTS=0.")
         points_gdf['PTS'] = 0
 
+    #Assign shots to grid cells
+    shot_idx, cell_idx = grid_tree.query(points_gdf.geometry.values, predicate="within")
+
     #Count shot attempts (FGA)
-    joined_gdf = gpd.sjoin(grid_gdf, points_gdf[['geometry']], how="inner", predicate="contains")
     print(f"Calculating shot attempts (FGA) for {input_file.name}...")
-    fga_df = joined_gdf.groupby(joined_gdf.index).size().reset_index(name='FGA')
+    fga = np.bincount(cell_idx, minlength=len(grid_gdf))
+    has_shots = fga > 0
 
-    result_gdf = grid_gdf.loc[fga_df['index']].copy()
-    result_gdf['FGA'] = fga_df['FGA'].values
+    result_gdf = grid_gdf[has_shots].copy()
+    result_gdf['FGA'] = fga[has_shots]
 
     #Calculate Points Per Basket (PPB)
     print(f"Calculating Points Per Basket (PPB) for {input_file.name}...")
     if 'distance' in grid_gdf.columns:
-        result_gdf['PPB'] = np.where(grid_gdf.loc[result_gdf.index, 'distance'] > 6.62, 3, 2)
+        result_gdf['PPB'] = np.where(result_gdf['distance'].to_numpy() > 6.62, 3, 2)
     else:
         print(f"Column 'distance' missing. Setting PPB=2.")
         result_gdf['PPB'] = 2
@@ -115,15 +113,15 @@ for input_file in input_files:
     #Calculate Expected local Points (ELPTS)
     print(f"Calculating expected local points (ELPTS) for {input_file.name}...")
     if 'EB_PPA' in grid_gdf.columns:
-        result_gdf['ELPTS'] = grid_gdf.loc[result_gdf.index, 'EB_PPA'] * result_gdf['FGA']
+        result_gdf['ELPTS'] = result_gdf['EB_PPA'].to_numpy() * result_gdf['FGA'].to_numpy()
     else:
         print(f"Column 'EB_PPA' missing. Setting EB_PPA=1.")
         result_gdf['ELPTS'] = 1 * result_gdf['FGA']
 
-    #Calculate sum of points in grid cells (PTS_sum)
-    joined_summary = gpd.sjoin(result_gdf, points_gdf[['geometry', 'PTS']], how="left", predicate="contains")
-    pts_sum = joined_summary.groupby(joined_summary.index)['PTS'].sum().reset_index(name='PTS')
-    result_gdf['PTS'] = pts_sum['PTS'].fillna(0).values
+    #Calculate sum of points in grid cells (PTS_sum) from the same shot-cell pairs
+    pts = points_gdf['PTS'].to_numpy()
+    pts_sum = np.bincount(cell_idx, weights=pts[shot_idx], minlength=len(grid_gdf)).astype(pts.dtype)
+    result_gdf['PTS'] = pts_sum[has_shots]
 
     #Calculate local Points Relative to league Average (LPRLA)
     print(f"Calculating local points relative to league average (LPRLA) for {input_file.name}...")
@@ -136,17 +134,43 @@ for input_file in input_files:
     #Calculate local Spatial Shooting Efficiency (LSScE)
     print(f"Calculating local spatial shooting efficiency (LSScE) for {input_file.name}...")
     if 'EB_PPA' in grid_gdf.columns:
-        result_gdf['LSScE'] = result_gdf['LPPA'] - grid_gdf.loc[result_gdf.index, 'EB_PPA']
+        result_gdf['LSScE'] = result_gdf['LPPA'].to_numpy() - result_gdf['EB_PPA'].to_numpy()
     else:
         result_gdf['LSScE'] = result_gdf['LPPA'] - 1
 
     print(f"Number of rows in result_gdf for {input_file.name}: {len(result_gdf)}")
 
-    #Save results as shapefiles and CSVs
+    #Save results as GeoPackages and CSVs (CSVs are read by global_metrics.py)
     final_output_name = f"{layer_name}_localmetrics"
-    result_gdf.to_file(output_folder / f"{final_output_name}.shp")
+    result_gdf.to_file(output_folder / f"{final_output_name}.gpkg", driver="GPKG", engine="pyogrio")
     result_gdf.to_csv(output_folder / f"{final_output_name}.csv", index=False)
 
     print(f"Processed {input_file.name}. Files saved in: {output_folder}")
 
-print("Data processing completed for all shapefiles.")
+#Run main block with single input
+if __name__ == "__main__":
+    input_folder, grid_layer_path, output_folder = define_input()
+    print("Input file paths collected successfully.")
+
+    #Create output directory if it doesn't exist
+    output_folder.mkdir(parents=True, exist_ok=True)
+    print(f"Output directory created or already exists: {output_folder}")
+
+    #Load EB layer and select relevant columns
+    print("Loading EB grid layer...")
+    grid_gdf, _ = load_grid(grid_layer_path)
+    print(f"Number of polygons in grid_gdf: {len(grid_gdf)}")
+
+    #Collect all shapefile and GeoPackage paths from input folder
+    input_files = [f for f in input_folder.iterdir() if f.suffix.lower() in (".shp", ".gpkg")]
+    print(f"Found {len(input_files)} layer(s) in input folder.")
+
+    #Process data in parallel, one layer per worker
+    print("Starting data processing for layers...")
+    with ProcessPoolExecutor() as executor:
+        list(executor.map(
+            partial(process_one_file, grid_layer_path=grid_layer_path, output_folder=output_folder),
+            input_files
+        ))
+
+    print("Data processing completed for all layers.")
@@ -1,9 +1,22 @@
 import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
+import orjson
 import pandas as pd
+import numpy as np
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 import geopandas as gpd
-from shapely.geometry import Point
+
+#Precompiled patterns (game page URL, whitespace in player names)
+FIBA_URL_RE = re.compile(r"https://www\.fibalivestats\.com/u/\w+/(\d+)/")
+WS_RE = re.compile(r'\s+')
+
+#Shot types mapped to their point value
+ACTION_MAP = {"3pt": 3, "2pt": 2}
 
 #Input with validation
 def define_input():
@@ -60,28 +73,90 @@ print(f"Parameters set: League={league}, Clue={clue}, Start ID={start_id}, End I
 print(f"Output folder: {output_folder}, Filename: {export_filename}")
 print("User input collection completed.")
 
-#Find games' URLs
+#Create output folder if it doesn't exist
+if not os.path.exists(output_folder):
+    print(f"Creating output folder: {output_folder}")
+    os.makedirs(output_folder)
+else:
+    print("Output folder already exists.")
+
+#Shared HTTP session with persistent cache (in output folder), connection pooling and retries
+#Empty (404) game pages are cached for an hour, JSON data for a day
+#Found pages are not cached - caching reads the whole page and defeats the streaming clue search
+session = requests_cache.CachedSession(
+    os.path.join(output_folder, 'fiba_cache.sqlite'),
+    backend='sqlite',
+    expire_after=86400,
+    urls_expire_after={'*fibalivestats.com/u/*': 3600},
+    filter_fn=lambda response: not ('/u/' in response.url and response.status_code == 200),
+    allowable_methods=('GET',),
+    allowable_codes=(200, 404)
+)
+adapter = HTTPAdapter(
+    pool_connections=64,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504))
+)
+session.mount('https://', adapter)
+
+#Check if game page exists and contains the clue (stops reading once clue is found)
+def probe_url(url):
+    needle = clue.encode('utf-8')
+    try:
+        with session.get(url, stream=True, timeout=(3, 10)) as resp:
+            if resp.status_code != 200:
+                return False
+            buffer = b""
+            for chunk in resp.iter_content(65536):
+                buffer += chunk
+                if needle in buffer:
+                    return True
+                #Keep only the tail that may hold the start of the clue
+                buffer = buffer[-(len(needle) - 1):] if len(needle) > 1 else b""
+    except requests.RequestException as e:
+        print(f"Request failed for {url}: {e}")
+    return False
+
+#Find game IDs listed on the league page within ID range (empty if none are listed)
+def find_candidate_ids(league, start_id, end_id):
+    league_url = 'https://www.fibalivestats.com/u/{}/'.format(league)
+    try:
+        resp = session.get(league_url, timeout=(3, 10))
+    except requests.RequestException as e:
+        print(f"Request failed for {league_url}: {e}")
+        return []
+    if resp.status_code != 200:
+        return []
+    listed_ids = {int(g_id) for g_id in re.findall(r'/u/{}/(\d+)/'.format(re.escape(league)), resp.text)}
+    return sorted(g_id for g_id in listed_ids if start_id <= g_id <= end_id)
+
+#Find games' URLs (probed concurrently, network-bound)
 print("Searching for game URLs...")
 baseurl = 'https://www.fibalivestats.com/u/{}'.format(league)
+game_ids = find_candidate_ids(league, start_id, end_id)
+if game_ids:
+    print(f"Found {len(game_ids)} game IDs on league page, probing only those.")
+else:
+    print("No game IDs listed on league page, scanning full ID range.")
+    game_ids = range(start_id, end_id + 1)
+candidate_urls = ["{}/{}/".format(baseurl, g_id) for g_id in game_ids]
 old_urls = []
-for g_id in range(start_id, end_id + 1):
-    url = "{}/{}/".format(baseurl, g_id)
-    resp = requests.get(url)
-    if resp.status_code == 200 and resp.text.find(clue) > -1:
-        print(f"Valid URL found: {url}")
-        old_urls.append(url)
-    else:
-        print(f"Skipping URL: {url} (Clue not found)")
+with ThreadPoolExecutor(max_workers=64) as executor:
+    for url, valid in zip(candidate_urls, executor.map(probe_url, candidate_urls)):
+        if valid:
+            print(f"Valid URL found: {url}")
+            old_urls.append(url)
+        else:
+            print(f"Skipping URL: {url} (Clue not found)")
 print(f"Found {len(old_urls)} valid URLs.")
 
 #Convert URLs to JSON data
 def convert_urls(old_urls):
     print("Converting URLs to JSON format...")
     new_urls = []
-    pattern = re.compile(r"https://www\.fibalivestats\.com/u/\w+/(\d+)/")
     
     for url in old_urls:
-        match = pattern.match(url)
+        match = FIBA_URL_RE.match(url)
         if match:
             match_id = match.group(1)
             new_url = f"https://fibalivestats.dcd.shared.geniussports.com/data/{match_id}/data.json"
@@ -97,15 +172,24 @@ for url in json_urls:
 
 #Fetch JSON data from a URL
 def url_data(url):
-    response = requests.get(url)
+    try:
+        response = session.get(url, timeout=(3, 10))
+    except requests.RequestException as e:
+        print(f"Error. Request failed for {url}: {e}")
+        return None
     if response.status_code == 200:
+        try:
+            data = orjson.loads(response.content)
+        except orjson.JSONDecodeError as e:
+            print(f"Error. Invalid JSON from {url}: {e}")
+            return None
         print(f"Successfully fetched data from: {url}")
-        return response.json()
+        return data
     else:
         print(f"Error. Status code: {response.status_code} for {url}")
         return None
 
-#Convert and rotate court coordinates
+#Convert and rotate court coordinates (works on scalars and arrays)
 def coords(x, y):
     minX, maxX = -7.5, 7.5
     minY, maxY = -14.0, 14.0
@@ -117,15 +201,18 @@ def coords(x, y):
     final_y = minY + (rot_y + 0.5) * (maxY - minY)
     
     #flipping coordinates if shot is taken beyond half-court
-    if final_y < 0:
-        final_y = -final_y
-        final_x = -final_x
+    flip = final_y < 0
+    final_x = np.where(flip, -final_x, final_x)
+    final_y = np.where(flip, -final_y, final_y)
     return final_x, final_y
 
 #Process data
 def process_data(json_data, clue=None):
     print("Processing JSON data...")
-    shooting_data = []
+    shooting_data = {column: [] for column in (
+        "team", "team_code", "opponent", "player", "shirtNum", "quarter",
+        "period", "action", "made", "x", "y", "actionNum"
+    )}
     teams = json_data.get("tm", {})
     team_codes = {key: data.get("code", f"Unknown Code {key}") for key, data in teams.items()}
     
@@ -135,67 +222,86 @@ def process_data(json_data, clue=None):
         opponent_key = "1" if team_key == "2" else "2"
         opponent_code = team_codes.get(opponent_key, "Unknown Code")
 
-        for shot in team_data.get("shot", []):
-            if isinstance(shot, dict):
-                action = shot.get("actionType", None)
-                if action == "3pt":
-                    action = 3
-                elif action == "2pt":
-                    action = 2
-
-                shooting_data.append({
-                    "team": team_name,
-                    "team_code": team_code,
-                    "opponent": opponent_code,
-                    "player": shot.get("player", "Unknown Player"),
-                    "shirtNum": shot.get("shirtNumber", "Unknown"),
-                    "quarter": shot.get("per", None),
-                    "period": shot.get("perType", None),
-                    "action": action,
-                    "made": shot.get("r", None),
-                    "x": shot.get("x", None),
-                    "y": shot.get("y", None),
-                    "actionNum": shot.get("actionNumber", None)
-                })
+        shots = [shot for shot in team_data.get("shot", []) if isinstance(shot, dict)]
+        for shot in shots:
+            action = shot.get("actionType", None)
+            action = ACTION_MAP.get(action, action)
+
+            shooting_data["team"].append(team_name)
+            shooting_data["team_code"].append(team_code)
+            shooting_data["opponent"].append(opponent_code)
+            shooting_data["player"].append(shot.get("player", "Unknown Player"))
+            shooting_data["shirtNum"].append(shot.get("shirtNumber", "Unknown"))
+            shooting_data["quarter"].append(shot.get("per", None))
+            shooting_data["period"].append(shot.get("perType", None))
+            shooting_data["action"].append(action)
+            shooting_data["made"].append(shot.get("r", None))
+            shooting_data["x"].append(shot.get("x", None))
+            shooting_data["y"].append(shot.get("y", None))
+            shooting_data["actionNum"].append(shot.get("actionNumber", None))
     
+    #Build DataFrame from column lists
     df = pd.DataFrame(shooting_data)
     if not df.empty:
-        df[['x', 'y']] = df.apply(lambda row: coords(row['x'], row['y']), axis=1, result_type="expand")
+        df['x'], df['y'] = coords(df['x'].to_numpy(dtype=float), df['y'].to_numpy(dtype=float))
         print("Coordinate conversion completed.")
     else:
         print("No shooting data found.")
     print("Data processing completed.")
     return df
 
-#Process all games and combine data
+#Process all games and combine data, appending each game to the CSV as it arrives
 print("Starting processing of all games...")
-total_data = pd.DataFrame()
-for url in json_urls:
-    data_json = url_data(url)
-    if data_json:
-        data_frame = process_data(data_json, clue)
-        if not data_frame.empty:
-            total_data = pd.concat([total_data, data_frame], ignore_index=True)
-            print(f"Added data from {url} to total dataset.")
-        else:
-            print(f"No data to add from {url}.")
-print("Processing of all games completed.")
+print("Exporting data to CSV...")
+csv_had_earlier_data = os.path.exists(export)
+if csv_had_earlier_data:
+    print(f"Appending to existing CSV file: {export}")
+header_written = csv_had_earlier_data
+#Games are written to a temporary file first, so a failed run leaves the CSV untouched
+part_export = export + '.part'
+csv_file = None
+game_frames = []
+#Fetch JSON data concurrently, process games in order as they arrive
+try:
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for url, data_json in zip(json_urls, executor.map(url_data, json_urls)):
+            if data_json:
+                data_frame = process_data(data_json, clue)
+                if not data_frame.empty:
+                    #CSV is opened once, on the first game with data
+                    if csv_file is None:
+                        csv_file = open(part_export, 'w', newline='')
+                    data_frame.to_csv(csv_file, index=False, header=not header_written)
+                    header_written = True
+                    game_frames.append(data_frame)
+                    print(f"Added data from {url} to total dataset.")
+                else:
+                    print(f"No data to add from {url}.")
+finally:
+    if csv_file is not None:
+        csv_file.close()
 
-#Create output folder if it doesn't exist
-if not os.path.exists(output_folder):
-    print(f"Creating output folder: {output_folder}")
-    os.makedirs(output_folder)
-else:
-    print("Output folder already exists.")
+#Move finished games into the CSV
+if csv_file is not None:
+    if csv_had_earlier_data:
+        with open(part_export, 'rb') as src, open(export, 'ab') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(part_export)
+    else:
+        os.replace(part_export, export)
+
+#Kept in memory for the Parquet copy and per-player split
+total_data = pd.concat(game_frames, ignore_index=True) if game_frames else pd.DataFrame()
+#Convert numeric text columns (e.g. shirtNum) to numbers, as reading the CSV back would
+for column in total_data.columns:
+    if pd.api.types.is_numeric_dtype(total_data[column]):
+        continue
+    converted = pd.to_numeric(total_data[column], errors='coerce')
+    if converted.notna().sum() == total_data[column].notna().sum():
+        total_data[column] = converted
+print("Processing of all games completed.")
 
-#Export data to CSV
-print("Exporting data to CSV...")
 if not total_data.empty:
-    if not os.path.exists(export):
-        total_data.to_csv(export, index=False)
-    else:
-        print(f"Appending to existing CSV file: {export}")
-        total_data.to_csv(export, index=False, mode='a', header=False)
     print(f"Data has been saved to {export}")
 else:
     print("No data has been found to save.")
@@ -204,13 +310,39 @@ else:
 # Section: exporting each player's data as a separate SHP and CSV file
 # ------------------------------------------------------------
 
-input_csv_path = export  
+#Export single player's shots to SHP and CSV files
+def export_player(player, player_df, file_name, players_folder):
+    if player_df.empty:
+        print(f"No data found for player {player}, skipping SHP and CSV file creation.")
+        return
 
-#checking if CSV file exists before reading
-if os.path.exists(input_csv_path):
-    print("Reading CSV file...")
-    df = pd.read_csv(input_csv_path)
+    #export to SHP in players' folder
+    shp_output_path = os.path.join(players_folder, f"{file_name}.shp")
+    print(f"Saving SHP file for player {player}: {shp_output_path}")
+    player_df.to_file(shp_output_path, driver='ESRI Shapefile', engine='pyogrio')
     
+    #export to CSV in players' folder
+    csv_output_path = os.path.join(players_folder, f"{file_name}.csv")
+    print(f"Saving CSV file for player {player}: {csv_output_path}")
+    player_df.drop(columns='geometry').to_csv(csv_output_path, index=False)
+
+#Reuse scraped data, read CSV only if it also holds data from earlier runs
+if csv_had_earlier_data:
+    print("Reading CSV file...")
+    df = pd.read_csv(export)
+else:
+    df = total_data
+
+#Export full dataset to Parquet (typed, compressed copy of the CSV)
+if not df.empty:
+    parquet_export = os.path.splitext(export)[0] + '.parquet'
+    try:
+        df.to_parquet(parquet_export, compression='zstd', index=False)
+        print(f"Data has been saved to {parquet_export}")
+    except Exception as e:
+        print(f"Failed to save {parquet_export}: {e}")
+
+if not df.empty:
     #Create players' folder in output directory
     players_folder = os.path.join(output_folder, "players")
     print(f"Checking players folder: {players_folder}")
@@ -221,29 +353,27 @@ if os.path.exists(input_csv_path):
         print("Players folder already exists.")
     
     #Create geometry for spatial data
-    geometry = [Point(xy) for xy in zip(df['x'], df['y'])]
-    gdf = gpd.GeoDataFrame(df, geometry=geometry)
+    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df['x'], df['y']), crs="EPSG:3857")
     
-    gdf.crs = "EPSG:3857"
-    
-    #Generate files
+    #Group players by file name (different names can map to the same file)
+    file_groups = {}
+    for player, player_df in gdf.groupby('player', sort=False):
+        file_name = WS_RE.sub('_', player.replace('.', ''))
+        file_groups.setdefault(file_name, []).append((player, player_df))
+    for file_name, players in file_groups.items():
+        if len(players) > 1:
+            print(f"Warning: players {', '.join(player for player, _ in players)} share file name {file_name}, only the last one is kept.")
+
+    #Export players sharing a file name one after another, in order
+    def export_file_group(file_name, players):
+        for player, player_df in players:
+            export_player(player, player_df, file_name, players_folder)
+
+    #Generate files (file names are independent, exported in parallel)
     print("Generating SHP and CSV files for each player...")
-    for player in df['player'].unique():
-        player_df = gdf[gdf['player'] == player]
-        if not player_df.empty:
-            file_name = re.sub(r'\s+', '_', player.replace('.', ''))
-            #export to SHP in players' folder
-            shp_output_path = os.path.join(players_folder, f"{file_name}.shp")
-            print(f"Saving SHP file for player {player}: {shp_output_path}")
-            player_df.to_file(shp_output_path, driver='ESRI Shapefile')
-            
-            #export to CSV in players' folder
-            csv_output_path = os.path.join(players_folder, f"{file_name}.csv")
-            print(f"Saving CSV file for player {player}: {csv_output_path}")
-            player_df.drop(columns='geometry').to_csv(csv_output_path, index=False)
-        else:
-            print(f"No data found for player {player}, skipping SHP and CSV file creation.")
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(export_file_group, file_groups.keys(), file_groups.values()))
     
     print(f"SHP and CSV files have been created in: {players_folder}")
 else:
-    print(f"File {input_csv_path} not found. Make sure the data scraping completed successfully.")
+    print("No shooting data to export for players. Make sure the data scraping completed successfully.")
@@ -1,5 +1,6 @@
 import os
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 
 #Input with validation
 def define_input():
@@ -48,46 +49,51 @@ def define_input():
             print("Please check your input format and try again.")
 
 
+#Load metrics row of single excel file (None if it cannot be used)
+def load_one(file_path):
+    file = os.path.basename(file_path)
+
+    #Read only second row without first 10 columns (with local metrics)
+    try:
+        df = pd.read_excel(
+            file_path,
+            header=None,
+            skiprows=1,
+            nrows=1,
+            usecols=lambda column: column >= 10,
+            engine='calamine'
+        )
+        print(f"Successfully loaded {file}")
+    except Exception as e:
+        print(f"Failed to load {file}: {e}")
+        return None
+
+    if df.empty:
+        print(f"File {file} is empty, skipping...")
+        return None
+
+    #Insert player name
+    player_name = os.path.splitext(file)[0]
+    df.insert(0, "player", player_name)
+    return df
+
 #Process excel files
 def process_excel_files(folder_path, output_filename):
     print("Starting processing of Excel files...")
-    all_data = []
 
     #Collect excel files
     print(f"Scanning folder for Excel files: {folder_path}")
-    excel_files = [f for f in os.listdir(folder_path) if f.endswith(('.xls', '.xlsx'))]
+    with os.scandir(folder_path) as entries:
+        excel_files = [e.path for e in entries if e.is_file() and e.name.endswith(('.xls', '.xlsx'))]
     print(f"Found {len(excel_files)} Excel file(s) in folder.")
 
     if not excel_files:
         print(f"No Excel files found in {folder_path}.")
         return
 
-    #Process each excel file
-    for file in excel_files:
-        file_path = os.path.join(folder_path, file)
-
-        try:
-            df = pd.read_excel(file_path, header=None)
-            print(f"Successfully loaded {file}")
-        except Exception as e:
-            print(f"Failed to load {file}: {e}")
-            continue
-
-        #Remove first 10 columns (with local metrics)
-        df = df.iloc[:, 10:]
-
-        #Select only second row
-        if not df.empty:
-            df = df.iloc[1:2]
-        else:
-            print(f"File {file} is empty, skipping...")
-            continue
-
-        #Insert player name
-        player_name = os.path.splitext(file)[0]
-        df.insert(0, "player", player_name)
-
-        all_data.append(df)
+    #Process excel files in parallel, files are independent
+    with ProcessPoolExecutor() as executor:
+        all_data = [df for df in executor.map(load_one, excel_files, chunksize=4) if df is not None]
 
     if not all_data:
         print("No valid data to process.")